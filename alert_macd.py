@@ -11,7 +11,8 @@ import os
 import sys
 import sqlite3
 import time
-from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import pandas as pd
 import numpy as np
 import logging
@@ -57,6 +58,8 @@ try:
         VOLUME_THRESHOLD_MODERATE, TAKER_BUY_THRESHOLD
     )
     from binance.client import Client
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     from telegram import Bot
     HAS_TELEGRAM = True
 except ImportError as e:
@@ -64,14 +67,52 @@ except ImportError as e:
     HAS_TELEGRAM = False
     BINANCE_API_KEY = BINANCE_API_SECRET = ""
     SYMBOLS = ["BTCUSDT"]
+    MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
     TRADING_HOURS = [(7, 10), (12, 16)]
     VOLUME_THRESHOLD_STRONG = 1.8
     VOLUME_THRESHOLD_MODERATE = 1.3
     TAKER_BUY_THRESHOLD = 65
 
+# Numba é opcional: sem ele os kernels rodam como Python puro (mais lento, mesmo resultado)
+try:
+    from numba import njit, prange
+except ImportError:
+    logger.warning("⚠️ Numba não disponível - kernels MACD em Python puro")
+    prange = range
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# orjson é opcional: parse 2-3x mais rápido das respostas da Binance (fallback: json da stdlib)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if HAS_TELEGRAM and orjson:
+    class OrjsonClient(Client):
+        """Client Binance que decodifica respostas de sucesso com orjson"""
+        def _handle_response(self, response):
+            if 200 <= response.status_code < 300:
+                try:
+                    return orjson.loads(response.content)
+                except orjson.JSONDecodeError:
+                    pass
+            # Erros HTTP / JSON inválido: mesmo tratamento (e exceções) do Client original
+            return super()._handle_response(response)
+    
+    BinanceClient = OrjsonClient
+elif HAS_TELEGRAM:
+    BinanceClient = Client
+
 # Inicialização do cliente Binance (com fallback para modo offline)
 try:
-    client = Client(BINANCE_API_KEY, BINANCE_API_SECRET) if BINANCE_API_KEY else None
+    client = BinanceClient(BINANCE_API_KEY, BINANCE_API_SECRET) if BINANCE_API_KEY else None
+    if client:
+        # Pool keep-alive compartilhado pelas threads de get_klines (um handshake TLS por conexão, não por request)
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=Retry(total=3, backoff_factor=0.2))
+        client.session.mount('https://', adapter)
 except Exception as e:
     logger.error(f"❌ Erro ao inicializar Binance Client: {e}")
     client = None
@@ -80,10 +121,27 @@ except Exception as e:
 bot = Bot(token=TELEGRAM_TOKEN) if HAS_TELEGRAM and TELEGRAM_TOKEN else None
 
 DB_PATH = "alerts.db"
+_db_conn = None
+
+def get_connection():
+    """Retorna a conexão SQLite única do processo (autocommit + WAL)"""
+    global _db_conn
+    if _db_conn is None:
+        _db_conn = sqlite3.connect(DB_PATH, isolation_level=None)
+        _db_conn.execute("PRAGMA journal_mode=WAL")
+        _db_conn.execute("PRAGMA synchronous=NORMAL")
+    return _db_conn
+
+def close_connection():
+    """Fecha a conexão persistente (faz o checkpoint do WAL para o alerts.db)"""
+    global _db_conn
+    if _db_conn is not None:
+        _db_conn.close()
+        _db_conn = None
 
 def init_database():
     """Inicializa o banco SQLite com estrutura persistente"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     
     # Criar tabelas
@@ -94,10 +152,21 @@ def init_database():
             max_histogram REAL,
             alert_sent INTEGER DEFAULT 0,
             last_check INTEGER,
-            volume_score INTEGER DEFAULT 0
+            volume_score INTEGER DEFAULT 0,
+            ema_fast REAL,
+            ema_slow REAL,
+            ema_signal REAL,
+            last_bar_time INTEGER,
+            macd_spans TEXT
         )
     ''')
     
+    # Migrar bancos antigos: colunas do estado MACD incremental
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(alerts)")}
+    for column, column_type in (("ema_fast", "REAL"), ("ema_slow", "REAL"), ("ema_signal", "REAL"), ("last_bar_time", "INTEGER"), ("macd_spans", "TEXT")):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE alerts ADD COLUMN {column} {column_type}")
+    
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS alert_history (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -113,17 +182,32 @@ def init_database():
     ''')
     
     # Inserir símbolos iniciais se não existirem
-    for symbol in SYMBOLS:
-        cursor.execute(
-            "INSERT OR IGNORE INTO alerts (symbol, last_zero_cross, max_histogram, alert_sent, last_check, volume_score) VALUES (?, ?, ?, ?, ?, ?)",
-            (symbol, 0, 0.0, 0, 0, 0)
-        )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO alerts (symbol, last_zero_cross, max_histogram, alert_sent, last_check, volume_score) VALUES (?, ?, ?, ?, ?, ?)",
+        [(symbol, 0, 0.0, 0, 0, 0) for symbol in SYMBOLS]
+    )
     
-    conn.commit()
-    conn.close()
     logger.info("✅ Banco de dados inicializado")
 
-def get_klines(symbol, interval='5m', limit=100):
+# Janela da partida a frio: aquecimento do MACD semeado por SMA (MACD_SLOW + MACD_SIGNAL - 1 candles)
+# + folga para o zero cross; mínimo de 50 exigido por detect_macd_pattern (50 com 12/26/9)
+KLINES_LIMIT = max(MACD_SLOW + MACD_SIGNAL + 15, 50)
+
+# Períodos que geraram o estado MACD persistido: se mudarem no config.py, o estado é descartado
+MACD_SPANS = f"{MACD_FAST},{MACD_SLOW},{MACD_SIGNAL}"
+
+# Mínimo de candles para validate_volume (MA20 + folga)
+VOLUME_MIN_CANDLES = 25
+
+# Idade máxima (em candles antes do último) de um zero cross "recente": o mesmo alcance da partida a frio,
+# onde o MACD só tem dois valores consecutivos a partir do candle MACD_SLOW da janela de KLINES_LIMIT
+MAX_ZERO_CROSS_AGE = KLINES_LIMIT - 1 - MACD_SLOW
+
+# Candles buscados quando já existe estado MACD persistido: o necessário para validate_volume
+# e para que qualquer zero cross recente (e o volume desde ele) esteja dentro da janela
+INCREMENTAL_KLINES_LIMIT = max(VOLUME_MIN_CANDLES, MAX_ZERO_CROSS_AGE + 1)
+
+def get_klines(symbol, interval='5m', limit=KLINES_LIMIT):
     """
     Obtém candles da Binance com fallback para dados simulados (offline)
     """
@@ -133,97 +217,310 @@ def get_klines(symbol, interval='5m', limit=100):
     
     try:
         klines = client.get_klines(symbol=symbol, interval=interval, limit=limit)
-        df = pd.DataFrame(klines, columns=[
-            'open_time', 'open', 'high', 'low', 'close', 'volume',
-            'close_time', 'quote_asset_volume', 'number_of_trades',
-            'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
-        ])
+        # Converter só as colunas usadas (open_time, close, volume, quote_asset_volume, taker_buy_quote_asset_volume)
+        arr = np.array(klines, dtype=object)
+        if arr.size == 0:
+            return pd.DataFrame()
         
-        # Conversão de tipos
-        df['open_time'] = pd.to_datetime(df['open_time'], unit='ms', utc=True)
-        df['close'] = df['close'].astype(float)
-        df['volume'] = df['volume'].astype(float)
-        df['taker_buy_volume'] = df['taker_buy_quote_asset_volume'].astype(float)
-        
-        return df[['open_time', 'close', 'volume', 'taker_buy_volume']]
+        return pd.DataFrame({
+            'open_time': pd.DatetimeIndex(arr[:, 0].astype(np.int64).astype('datetime64[ms]'), tz='UTC'),
+            'close': arr[:, 4].astype(np.float64),
+            'volume': arr[:, 5].astype(np.float64),
+            'quote_asset_volume': arr[:, 7].astype(np.float64),
+            'taker_buy_volume': arr[:, 10].astype(np.float64)
+        })
     
     except Exception as e:
         logger.error(f"❌ Erro ao buscar candles {symbol}: {e}")
         return pd.DataFrame()
 
-def generate_mock_data(symbol, limit=100):
-    """Gera dados simulados para teste offline"""
-    now = datetime.now(timezone.utc)
-    timestamps = [now - timedelta(minutes=5*i) for i in range(limit)][::-1]
-    
-    # Simular movimento com reversão e expansão
+def generate_mock_data(symbol, limit=100, seed=None):
+    """Gera dados simulados para teste offline (seed fixa = dados reprodutíveis)"""
+    # open_time alinhado a 5 min como na Binance (último candle = o em formação), para que
+    # execuções seguidas encontrem last_bar_time e usem a atualização incremental
+    now = pd.Timestamp.now(tz='UTC').floor('5min')
+    timestamps = now - pd.to_timedelta(5 * np.arange(limit - 1, -1, -1), unit='m')
+    
+    # Simular movimento com reversão e expansão, em ciclos de 100 candles contados pelo open_time
+    # (não pela posição na janela): janelas sobrepostas de tamanhos diferentes veem os mesmos preços
+    i = np.asarray((timestamps - pd.Timestamp(0, tz='UTC')) // pd.Timedelta('5min')) % 100
     base_price = 100.0
-    prices = []
-    for i in range(limit):
-        if i < 30:
-            prices.append(base_price - i * 0.1)  # Queda
-        elif i < 50:
-            prices.append(base_price - 3.0 + (i-30) * 0.3)  # Reversão forte
-        else:
-            prices.append(base_price + 3.0 + (i-50) * 0.05)  # Consolidação
+    prices = np.where(
+        i < 30, base_price - i * 0.1,                      # Queda
+        np.where(i < 50, base_price - 3.0 + (i-30) * 0.3,  # Reversão forte
+                 base_price + 3.0 + (i-50) * 0.05)         # Consolidação
+    )
+    
+    # Volumes em quote asset (como em get_klines): base × preço
+    rng = np.random.default_rng(seed)
+    volume = 1000 + rng.random(limit)*500
+    taker_buy_base = 600 + rng.random(limit)*300
     
     df = pd.DataFrame({
         'open_time': timestamps,
         'close': prices,
-        'volume': [1000 + np.random.rand()*500 for _ in range(limit)],
-        'taker_buy_volume': [600 + np.random.rand()*300 for _ in range(limit)]
+        'volume': volume,
+        'quote_asset_volume': volume * prices,
+        'taker_buy_volume': taker_buy_base * prices
     })
     return df
 
-def calculate_macd(df):
-    """Calcula MACD, Signal Line e Histograma"""
-    exp1 = df['close'].ewm(span=MACD_FAST, adjust=False).mean()
-    exp2 = df['close'].ewm(span=MACD_SLOW, adjust=False).mean()
-    macd_line = exp1 - exp2
-    signal_line = macd_line.ewm(span=MACD_SIGNAL, adjust=False).mean()
-    histogram = macd_line - signal_line
-    
-    return macd_line, signal_line, histogram
+# Assinaturas explícitas: compilação na importação + cache em disco (NUMBA_CACHE_DIR no GitHub Actions),
+# evitando pagar o JIT (~1-2s) a cada execução do cron
+@njit('Tuple((i8, i8, f8, f8, f8))(f8[:], i8, i8, i8)', cache=True, fastmath=True)
+def _macd_pattern_kernel(close, fast, slow, signal):
+    """
+    MACD (EMAs semeadas pela SMA do período) + zero cross + pico do histograma em uma única passada, com estado O(1)
+    Retorna: (zero_cross_idx, direção, pico |hist| desde o cross, distância atual, hist atual)
+    onde zero_cross_idx = -1 se não houver cruzamento e direção = 1 (bullish) / -1 (bearish)
+    """
+    n = close.shape[0]
+    if n < slow + signal - 1:
+        return -1, 0, 0.0, 0.0, 0.0
+    
+    a_f = 2.0 / (fast + 1)
+    a_s = 2.0 / (slow + 1)
+    a_sig = 2.0 / (signal + 1)
+    
+    sum_f = 0.0
+    sum_s = 0.0
+    sum_sig = 0.0
+    ef = 0.0
+    es = 0.0
+    sg = 0.0
+    h = 0.0
+    hist_ready = False
+    prev_neg = False
+    zero_cross_idx = -1
+    direction = 0
+    max_hist_abs = 0.0
+    for i in range(n):
+        c = close[i]
+        # EMAs semeadas pela SMA do período (sem depender do primeiro candle)
+        if i < fast:
+            sum_f += c
+            ef = sum_f / fast
+        else:
+            ef = a_f * c + (1.0 - a_f) * ef
+        if i < slow:
+            sum_s += c
+            es = sum_s / slow
+        else:
+            es = a_s * c + (1.0 - a_s) * es
+        if i < slow - 1:
+            continue
+        
+        m = ef - es
+        j = i - (slow - 1)
+        if j < signal:
+            sum_sig += m
+            sg = sum_sig / (j + 1)
+        else:
+            sg = a_sig * m + (1.0 - a_sig) * sg
+        if j >= signal - 1:
+            h = m - sg
+            hist_ready = True
+        
+        # Zero cross: XOR do bit de sinal de candles vizinhos após o candle 10 (i = primeiro candle do novo lado)
+        neg = np.signbit(m)
+        if i > 10 and j > 0 and neg ^ prev_neg:
+            zero_cross_idx = i
+            direction = -1 if neg else 1
+            max_hist_abs = abs(h) if hist_ready else 0.0
+        elif zero_cross_idx >= 0 and hist_ready and abs(h) > max_hist_abs:
+            max_hist_abs = abs(h)
+        prev_neg = neg
+    
+    # Histograma = MACD - Signal, então a distância atual entre as linhas é |hist|
+    return zero_cross_idx, direction, max_hist_abs, abs(h), h
+
+@njit('Tuple((i8[:], i8[:], f8[:], f8[:], f8[:]))(f8[:, :], i8, i8, i8)', cache=True, parallel=True)
+def _macd_pattern_batch(closes, fast, slow, signal):
+    """_macd_pattern_kernel aplicado a cada linha de closes[num_símbolos, N], em paralelo entre símbolos"""
+    k = closes.shape[0]
+    zero_cross_idx = np.empty(k, dtype=np.int64)
+    direction = np.empty(k, dtype=np.int64)
+    max_hist_abs = np.empty(k, dtype=np.float64)
+    distance = np.empty(k, dtype=np.float64)
+    hist = np.empty(k, dtype=np.float64)
+    for r in prange(k):
+        zero_cross_idx[r], direction[r], max_hist_abs[r], distance[r], hist[r] = _macd_pattern_kernel(
+            closes[r], fast, slow, signal
+        )
+    return zero_cross_idx, direction, max_hist_abs, distance, hist
 
-def find_last_zero_cross(macd_series):
+@njit('Tuple((f8, f8, f8, f8, i8, f8))(f8[:], f8, f8, f8, f8, i8, i8, i8)', cache=True)
+def _macd_state_kernel(close, ema_fast, ema_slow, ema_signal, max_hist_abs, fast, slow, signal):
     """
-    Encontra o índice do último cruzamento da linha MACD na linha 0
-    Retorna: (índice, direção) onde direção = 'bullish' (cruzou para cima) ou 'bearish'
+    Avança o estado MACD (EMAs + pico |hist| desde o último zero cross) pelos candles de close
+    Estado NaN = partida a frio: EMAs semeadas pela SMA do período, como em _macd_pattern_kernel
+    Retorna: (ema_fast, ema_slow, ema_signal, max_hist_abs, posição do último cross em close ou -1, hist atual)
     """
-    for i in range(len(macd_series)-1, 10, -1):
-        prev = macd_series.iloc[i-1]
-        curr = macd_series.iloc[i]
+    n = close.shape[0]
+    cold = np.isnan(ema_signal)
+    if cold and n < slow + signal - 1:
+        return np.nan, np.nan, np.nan, 0.0, -1, np.nan
+    
+    a_f = 2.0 / (fast + 1)
+    a_s = 2.0 / (slow + 1)
+    a_sig = 2.0 / (signal + 1)
+    
+    ef = ema_fast
+    es = ema_slow
+    sg = ema_signal
+    h = ef - es - sg
+    hist_ready = not cold
+    has_prev = not cold
+    prev_neg = np.signbit(ef - es)
+    sum_f = 0.0
+    sum_s = 0.0
+    sum_sig = 0.0
+    cross_pos = -1
+    for i in range(n):
+        c = close[i]
+        if cold and i < fast:
+            sum_f += c
+            ef = sum_f / fast
+        else:
+            ef = a_f * c + (1.0 - a_f) * ef
+        if cold and i < slow:
+            sum_s += c
+            es = sum_s / slow
+        else:
+            es = a_s * c + (1.0 - a_s) * es
+        if cold and i < slow - 1:
+            continue
         
-        # Cruzamento de baixo para cima (bullish reversal)
-        if prev < 0 and curr >= 0:
-            return i, 'bullish'
-        # Cruzamento de cima para baixo (bearish reversal)
-        elif prev > 0 and curr <= 0:
-            return i, 'bearish'
+        m = ef - es
+        j = i - (slow - 1)
+        if cold and j < signal:
+            sum_sig += m
+            sg = sum_sig / (j + 1)
+            hist_ready = j >= signal - 1
+        else:
+            sg = a_sig * m + (1.0 - a_sig) * sg
+        if hist_ready:
+            h = m - sg
+        
+        # Mesmo critério de _macd_pattern_kernel: XOR do bit de sinal
+        neg = np.signbit(m)
+        if has_prev and neg ^ prev_neg:
+            cross_pos = i
+            max_hist_abs = abs(h) if hist_ready else 0.0
+        elif hist_ready and abs(h) > max_hist_abs:
+            max_hist_abs = abs(h)
+        prev_neg = neg
+        has_prev = True
+    
+    return ef, es, sg, max_hist_abs, cross_pos, h
+
+def compute_macd_patterns(klines_map):
+    """
+    Roda o kernel de padrão MACD para todos os símbolos com uma única chamada
+    Retorna: {símbolo: resultado de _macd_pattern_kernel} (só símbolos com dados suficientes)
+    """
+    # np.stack exige séries de mesmo tamanho: agrupar por quantidade de candles
+    groups = {}
+    for symbol, df in klines_map.items():
+        if len(df) >= 50:
+            groups.setdefault(len(df), []).append(symbol)
+    
+    patterns = {}
+    for symbols in groups.values():
+        closes = np.stack([klines_map[symbol]['close'].to_numpy(np.float64) for symbol in symbols], axis=0)
+        results = _macd_pattern_batch(closes, MACD_FAST, MACD_SLOW, MACD_SIGNAL)
+        for row, symbol in enumerate(symbols):
+            zero_cross_idx, direction, max_hist_abs, distance, hist = (col[row] for col in results)
+            patterns[symbol] = (int(zero_cross_idx), int(direction), float(max_hist_abs), float(distance), float(hist))
+    
+    return patterns
+
+def _open_times_ms(df):
+    """open_time dos candles como epoch em milissegundos (int64)"""
+    return df['open_time'].values.astype('datetime64[ms]').astype(np.int64)
+
+def seed_macd_state(df):
+    """
+    Partida a frio do estado MACD persistido a partir da janela completa de candles
+    Só os candles fechados entram no estado (o último, em formação, fica de fora)
+    Retorna: (ema_fast, ema_slow, ema_signal, max_histogram, last_zero_cross, last_bar_time) ou None
+    """
+    if len(df) < 2:
+        return None
+    
+    times = _open_times_ms(df)
+    close = df['close'].to_numpy(np.float64, copy=True)
+    ema_fast, ema_slow, ema_signal, max_hist, cross_pos, _ = _macd_state_kernel(
+        close[:-1], np.nan, np.nan, np.nan, 0.0, MACD_FAST, MACD_SLOW, MACD_SIGNAL
+    )
+    if np.isnan(ema_signal):
+        return None
+    
+    last_zero_cross = int(times[cross_pos] // 1000) if cross_pos >= 0 else 0
+    return ema_fast, ema_slow, ema_signal, max_hist, last_zero_cross, int(times[-2])
+
+def update_macd_state(df, macd_state):
+    """
+    Atualização incremental O(candles novos): incorpora ao estado persistido os candles fechados
+    posteriores a last_bar_time e avalia o candle em formação sem persisti-lo
+    Retorna: (pattern no formato de _macd_pattern_kernel para df, novo estado)
+    ou None se df não contém last_bar_time (lacuna → partida a frio)
+    """
+    ema_fast, ema_slow, ema_signal, max_hist, last_zero_cross, last_bar_time = macd_state
+    times = _open_times_ms(df)
+    pos = int(np.searchsorted(times, last_bar_time))
+    if pos >= len(times) - 1 or times[pos] != last_bar_time:
+        return None
+    
+    close = df['close'].to_numpy(np.float64, copy=True)
+    
+    # Candles fechados novos → estado persistido
+    ema_fast, ema_slow, ema_signal, max_hist, cross_pos, _ = _macd_state_kernel(
+        close[pos + 1:-1], ema_fast, ema_slow, ema_signal, max_hist, MACD_FAST, MACD_SLOW, MACD_SIGNAL
+    )
+    if cross_pos >= 0:
+        last_zero_cross = int(times[pos + 1 + cross_pos] // 1000)
+    new_state = (ema_fast, ema_slow, ema_signal, max_hist, last_zero_cross, int(times[-2]))
     
-    return None, None
+    # Candle em formação → só para a decisão desta execução
+    cur_fast, cur_slow, _, cur_max_hist, cur_cross, cur_hist = _macd_state_kernel(
+        close[-1:], ema_fast, ema_slow, ema_signal, max_hist, MACD_FAST, MACD_SLOW, MACD_SIGNAL
+    )
+    zero_cross_ms = times[-1] if cur_cross >= 0 else last_zero_cross * 1000
+    
+    # Mesmo alcance da partida a frio: cross mais antigo que MAX_ZERO_CROSS_AGE não conta como recente
+    zero_cross_idx = -1
+    if zero_cross_ms > 0:
+        idx = int(np.searchsorted(times, zero_cross_ms))
+        if idx < len(times) and times[idx] == zero_cross_ms and len(times) - 1 - idx <= MAX_ZERO_CROSS_AGE:
+            zero_cross_idx = idx
+    
+    direction = 1 if cur_fast - cur_slow >= 0 else -1
+    pattern = (zero_cross_idx, direction, cur_max_hist, abs(cur_hist), cur_hist)
+    return pattern, new_state
 
 def validate_volume(symbol, df, zero_cross_idx):
     """
     Validação tripla do volume para confirmar participação institucional
     Retorna: (score, mensagem, volume_ratio, taker_ratio)
     """
-    if len(df) < 25:
+    if len(df) < VOLUME_MIN_CANDLES:
         return 0, "❌ Dados insuficientes para análise de volume", 0, 0
     
     # 1. Volume relativo vs média móvel 20 períodos
-    volume_ma20 = df['volume'].rolling(20).mean().iloc[-1]
-    volume_atual = df['volume'].iloc[-1]
+    vol_arr = df['volume'].to_numpy()
+    volume_ma20 = vol_arr[-20:].mean()
+    volume_atual = vol_arr[-1]
     volume_ratio = volume_atual / volume_ma20 if volume_ma20 > 0 else 0
     
-    # 2. Taker Buy/Sell Ratio (fluxo institucional)
-    taker_buy = df['taker_buy_volume'].iloc[-1]
-    total_volume = df['volume'].iloc[-1] * df['close'].iloc[-1]  # Aproximação em quote asset
+    # 2. Taker Buy/Sell Ratio (fluxo institucional), ambos em quote asset direto da Binance
+    taker_buy = df['taker_buy_volume'].to_numpy()[-1]
+    total_volume = df['quote_asset_volume'].to_numpy()[-1]
     taker_ratio = (taker_buy / total_volume) * 100 if total_volume > 0 else 50
     
     # 3. Volume acumulado desde zero line cross (confirmação de sustentação)
-    if zero_cross_idx and zero_cross_idx < len(df):
-        volume_since_cross = df['volume'].iloc[zero_cross_idx:].sum()
+    if zero_cross_idx is not None and 0 <= zero_cross_idx < len(df):
+        volume_since_cross = vol_arr[zero_cross_idx:].sum()
         avg_volume_since_cross = volume_since_cross / (len(df) - zero_cross_idx)
         volume_sustained = avg_volume_since_cross > volume_ma20 * 0.9
     else:
@@ -268,9 +565,9 @@ def validate_volume(symbol, df, zero_cross_idx):
     
     return score, msg, volume_ratio, taker_ratio
 
-def is_trading_hour():
-    """Verifica se está dentro do horário de alta liquidez (UTC)"""
-    utc_now = datetime.now(timezone.utc)
+def is_trading_hour(current_ts):
+    """Verifica se está dentro do horário de alta liquidez (UTC) no instante current_ts (epoch s)"""
+    utc_now = datetime.fromtimestamp(current_ts, tz=timezone.utc)
     current_hour = utc_now.hour
     
     for start, end in TRADING_HOURS:
@@ -279,43 +576,31 @@ def is_trading_hour():
     
     return False, f"⚠️ Fora do horário ideal (agora: {current_hour:02d}:00 UTC)"
 
-def detect_macd_pattern(symbol):
+def detect_macd_pattern(symbol, df, pattern=None):
     """
     Detecta o padrão completo:
     1. Zero line cross (reversão)
     2. Pico do histograma desde a reversão
     3. Distância atual ≥ 2x pico do histograma
     4. Validação de volume institucional
+    Recebe os candles já obtidos (df) e, opcionalmente, o resultado pré-calculado do
+    kernel MACD (pattern, ver compute_macd_patterns / update_macd_state); retorna também a direção
     """
-    df = get_klines(symbol)
-    if df.empty or len(df) < 50:
-        return False, None, 0, 0, 0, 0, "Dados insuficientes", False
-    
-    # Calcular MACD
-    macd, signal, hist = calculate_macd(df)
-    df['macd'] = macd
-    df['signal'] = signal
-    df['hist'] = hist
-    
-    # 1. Encontrar último zero line cross
-    zero_cross_idx, direction = find_last_zero_cross(df['macd'])
-    if zero_cross_idx is None:
-        return False, None, 0, 0, 0, 0, "Sem zero line cross recente", False
-    
-    zero_cross_time = df['open_time'].iloc[zero_cross_idx]
-    
-    # 2. Encontrar pico MÁXIMO do histograma desde o zero cross
-    hist_since_cross = df['hist'].iloc[zero_cross_idx:].abs()
-    if hist_since_cross.empty:
-        return False, None, 0, 0, 0, 0, "Sem dados pós-reversão", False
-    
-    max_hist_value = hist_since_cross.max()
-    
-    # 3. Calcular distância ATUAL entre linhas
-    current_macd = df['macd'].iloc[-1]
-    current_signal = df['signal'].iloc[-1]
-    current_distance = abs(current_macd - current_signal)
-    current_hist = abs(df['hist'].iloc[-1])
+    if df.empty or (pattern is None and len(df) < 50):
+        return False, None, 0, 0, 0, 0, 0, "Dados insuficientes", False, None
+    
+    # 1-3. MACD, último zero line cross, pico do histograma e distância atual (kernel único)
+    if pattern is None:
+        # Cópia gravável: com Copy-on-Write o pandas devolve views read-only, que não casam com f8[:]
+        close = df['close'].to_numpy(np.float64, copy=True)
+        pattern = _macd_pattern_kernel(close, MACD_FAST, MACD_SLOW, MACD_SIGNAL)
+    zero_cross_idx, direction_int, max_hist_value, current_distance, _ = pattern
+    if zero_cross_idx < 0 or len(df) - 1 - zero_cross_idx > MAX_ZERO_CROSS_AGE:
+        return False, None, 0, 0, 0, 0, 0, "Sem zero line cross recente", False, None
+    
+    direction = 'bullish' if direction_int > 0 else 'bearish'
+    open_times = df['open_time'].values  # datetime64 (UTC) sem passar pelo BlockManager a cada acesso
+    zero_cross_time = pd.Timestamp(open_times[zero_cross_idx], tz='UTC')
     
     # 4. Verificar condição principal: distância ≥ 2x pico do histograma
     distance_ratio = current_distance / max_hist_value if max_hist_value > 0 else 0
@@ -338,14 +623,15 @@ def detect_macd_pattern(symbol):
     
     return (
         alert_triggered,
-        df['open_time'].iloc[-1],
+        pd.Timestamp(open_times[-1], tz='UTC'),
         current_distance,
         max_hist_value,
         volume_score,
         volume_ratio,
         taker_ratio,
         diag,
-        condition_met
+        condition_met,
+        direction
     )
 
 def send_telegram_alert(symbol, timestamp, distance, max_hist, volume_score, volume_ratio, taker_ratio, direction):
@@ -394,12 +680,10 @@ def send_telegram_alert(symbol, timestamp, distance, max_hist, volume_score, vol
         logger.error(f"❌ Falha ao enviar Telegram: {e}")
         return False
 
-def log_to_history(symbol, timestamp, distance, max_hist, volume_ratio, taker_ratio, volume_score, decision):
+def log_to_history(conn, symbol, timestamp, distance, max_hist, volume_ratio, taker_ratio, volume_score, decision):
     """Registra histórico de alertas para análise posterior"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
+        conn.execute('''
             INSERT INTO alert_history 
             (symbol, timestamp, macd_distance, max_histogram, volume_ratio, taker_buy_ratio, volume_score, decision)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
@@ -413,8 +697,6 @@ def log_to_history(symbol, timestamp, distance, max_hist, volume_ratio, taker_ra
             volume_score,
             decision
         ))
-        conn.commit()
-        conn.close()
     except Exception as e:
         logger.warning(f"⚠️ Erro ao registrar histórico: {e}")
 
@@ -422,37 +704,80 @@ def check_all_symbols():
     """Verifica todos os símbolos e dispara alertas conforme critério"""
     logger.info("🔍 Iniciando verificação MACD 5m...")
     
+    # Instante único da execução: mesmo valor para horário, cooldown e histórico
+    current_ts = int(time.time())
+    
     # Verificar horário de trading
-    in_trading_hour, hour_msg = is_trading_hour()
+    in_trading_hour, hour_msg = is_trading_hour(current_ts)
     logger.info(hour_msg)
     
     if not in_trading_hour:
         logger.info("⏭️ Pulando verificação - fora do horário de alta liquidez")
         return
     
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    conn = get_connection()
+    
+    # Estado anterior de todos os símbolos em uma única consulta
+    state = {}
+    macd_states = {}
+    for row in conn.execute(
+        "SELECT symbol, last_zero_cross, max_histogram, alert_sent, last_check, "
+        "ema_fast, ema_slow, ema_signal, last_bar_time, macd_spans FROM alerts"
+    ):
+        (symbol, last_zero_cross, max_histogram, alert_sent, last_check,
+         ema_fast, ema_slow, ema_signal, last_bar_time, macd_spans) = row
+        state[symbol] = (last_zero_cross, max_histogram, alert_sent, last_check)
+        # Estado gerado com outros períodos MACD não vale: partida a frio via seed_macd_state
+        if ema_signal is not None and last_bar_time and macd_spans == MACD_SPANS:
+            macd_states[symbol] = (ema_fast, ema_slow, ema_signal, max_histogram, last_zero_cross, last_bar_time)
+    sent_updates = []
+    reset_updates = []
+    
+    def fetch(symbol):
+        return get_klines(symbol, limit=INCREMENTAL_KLINES_LIMIT) if symbol in macd_states else get_klines(symbol)
+    
+    # Buscar candles de todos os símbolos em paralelo (I/O bound: tempo total ≈ maior RTT)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        klines_map = dict(zip(SYMBOLS, executor.map(fetch, SYMBOLS)))
+    
+    # Símbolos com estado persistido: atualização incremental só com os candles novos
+    patterns = {}
+    for symbol in SYMBOLS:
+        if symbol in macd_states and not klines_map[symbol].empty:
+            result = update_macd_state(klines_map[symbol], macd_states[symbol])
+            if result:
+                patterns[symbol], macd_states[symbol] = result
+    
+    # Partida a frio (sem estado ou com lacuna): janela completa e recálculo em lote
+    cold = [symbol for symbol in SYMBOLS if symbol not in patterns]
+    refetch = [symbol for symbol in cold if symbol in macd_states]
+    if refetch:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            klines_map.update(zip(refetch, executor.map(get_klines, refetch)))
+    cold_klines = {symbol: klines_map[symbol] for symbol in cold}
+    patterns.update(compute_macd_patterns(cold_klines))
+    for symbol, df in cold_klines.items():
+        macd_states[symbol] = seed_macd_state(df)
     
     alert_count = 0
-    current_ts = int(time.time())
     
     for symbol in SYMBOLS:
         logger.info(f"\n{'='*50}")
         logger.info(f"🔍 Analisando {symbol}...")
         
         # Obter estado anterior
-        cursor.execute("SELECT last_zero_cross, max_histogram, alert_sent, last_check FROM alerts WHERE symbol=?", (symbol,))
-        row = cursor.fetchone()
+        row = state.get(symbol)
         if not row:
-            cursor.execute("INSERT INTO alerts (symbol, last_zero_cross, max_histogram, alert_sent, last_check) VALUES (?, ?, ?, ?, ?)",
+            conn.execute("INSERT INTO alerts (symbol, last_zero_cross, max_histogram, alert_sent, last_check) VALUES (?, ?, ?, ?, ?)",
                          (symbol, 0, 0.0, 0, 0))
-            conn.commit()
             continue
         
         last_zero_cross, prev_max_hist, alert_sent, last_check = row
         
         # Detectar padrão
-        triggered, timestamp, distance, max_hist, volume_score, volume_ratio, taker_ratio, diag, macd_condition = detect_macd_pattern(symbol)
+        triggered, timestamp, distance, max_hist, volume_score, volume_ratio, taker_ratio, diag, macd_condition, direction = detect_macd_pattern(
+            symbol, klines_map[symbol], patterns.get(symbol)
+        )
         
         logger.info(f"📊 {diag}")
         
@@ -462,21 +787,10 @@ def check_all_symbols():
                 logger.warning(f"⏳ Cooldown ativo para {symbol} ({(current_ts - last_check)}s)")
                 continue
             
-            # Determinar direção (bullish/bearish) para o alerta
-            df = get_klines(symbol)
-            if not df.empty:
-                macd, _, _ = calculate_macd(df)
-                _, direction = find_last_zero_cross(macd)
-            else:
-                direction = 'bullish'
-            
             # Enviar alerta
             if send_telegram_alert(symbol, timestamp, distance, max_hist, volume_score, volume_ratio, taker_ratio, direction):
-                cursor.execute(
-                    "UPDATE alerts SET alert_sent=1, last_check=?, volume_score=? WHERE symbol=?",
-                    (current_ts, volume_score, symbol)
-                )
-                log_to_history(symbol, timestamp, distance, max_hist, volume_ratio, taker_ratio, volume_score, "ALERTA_ENVIADO")
+                sent_updates.append((current_ts, volume_score, symbol))
+                log_to_history(conn, symbol, timestamp, distance, max_hist, volume_ratio, taker_ratio, volume_score, "ALERTA_ENVIADO")
                 alert_count += 1
                 logger.info(f"🚨 ALERTA DISPARADO para {symbol}")
             else:
@@ -485,14 +799,24 @@ def check_all_symbols():
         else:
             # Resetar alert_sent se condição não atendida
             if alert_sent == 1:
-                cursor.execute("UPDATE alerts SET alert_sent=0 WHERE symbol=?", (symbol,))
-                log_to_history(symbol, datetime.now(timezone.utc), distance, max_hist, volume_ratio, taker_ratio, volume_score, "RESET")
+                reset_updates.append((symbol,))
+                log_to_history(conn, symbol, datetime.fromtimestamp(current_ts, tz=timezone.utc), distance, max_hist, volume_ratio, taker_ratio, volume_score, "RESET")
             
             status = "✅ Condição atendida" if macd_condition else "❌ Condição não atendida"
             logger.info(f"{status} | Score volume: {volume_score}/10")
     
-    conn.commit()
-    conn.close()
+    # Gravar todas as atualizações de estado em uma única transação
+    state_updates = [
+        (*macd_state, MACD_SPANS, symbol) for symbol, macd_state in macd_states.items() if macd_state is not None
+    ]
+    conn.execute("BEGIN")
+    conn.executemany("UPDATE alerts SET alert_sent=1, last_check=?, volume_score=? WHERE symbol=?", sent_updates)
+    conn.executemany("UPDATE alerts SET alert_sent=0 WHERE symbol=?", reset_updates)
+    conn.executemany(
+        "UPDATE alerts SET ema_fast=?, ema_slow=?, ema_signal=?, max_histogram=?, last_zero_cross=?, last_bar_time=?, macd_spans=? WHERE symbol=?",
+        state_updates
+    )
+    conn.execute("COMMIT")
     
     logger.info(f"\n{'='*50}")
     logger.info(f"✅ Verificação concluída | Alertas disparados: {alert_count}")
@@ -509,6 +833,8 @@ def main():
     except Exception as e:
         logger.exception(f"❌ Erro crítico: {e}")
         sys.exit(1)
+    finally:
+        close_connection()
 
 if __name__ == "__main__":
     main()
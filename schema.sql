@@ -6,7 +6,12 @@ CREATE TABLE IF NOT EXISTS alerts (
     max_histogram REAL,           -- Pico do histograma desde o zero cross
     alert_sent INTEGER DEFAULT 0, -- 1 = alerta enviado nas últimas 15min
     last_check INTEGER,           -- Última verificação (timestamp)
-    volume_score INTEGER DEFAULT 0 -- Score de validação de volume (0-10)
+    volume_score INTEGER DEFAULT 0, -- Score de validação de volume (0-10)
+    ema_fast REAL,                -- Estado MACD incremental: EMA rápida no último candle fechado
+    ema_slow REAL,                -- EMA lenta no último candle fechado
+    ema_signal REAL,              -- EMA da Signal Line no último candle fechado
+    last_bar_time INTEGER,        -- open_time (ms) do último candle fechado incorporado ao estado
+    macd_spans TEXT               -- Períodos "fast,slow,signal" que geraram o estado (mudou = recalcular)
 );
 
 -- Tabela para histórico de alertas (opcional, para análise)
@@ -0,0 +1,88 @@
+"""
+Atualização incremental do MACD (update_macd_state) vs partida a frio sobre o histórico completo
+Executar com: python -m pytest tests/
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import alert_macd as am
+
+BAR_MS = 300_000
+
+
+def make_candles(n, seed):
+    """Random walk com open_time alinhado a 5 minutos, no formato de get_klines"""
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(size=n))
+    volume = 1000 + rng.random(n) * 500
+    t0 = 1_700_000_000_000 - 1_700_000_000_000 % BAR_MS
+    return pd.DataFrame({
+        'open_time': pd.to_datetime(t0 + BAR_MS * np.arange(n), unit='ms', utc=True),
+        'close': close,
+        'volume': volume,
+        'quote_asset_volume': volume * close,
+        'taker_buy_volume': volume * close * rng.uniform(0.3, 0.8, n),
+    })
+
+
+def warm_runs(full, steps):
+    """Simula execuções sucessivas: semeia com KLINES_LIMIT candles e avança com janelas incrementais"""
+    state = am.seed_macd_state(full.iloc[:am.KLINES_LIMIT])
+    assert state is not None
+    end = am.KLINES_LIMIT
+    for step in steps:
+        end += step
+        window = full.iloc[end - am.INCREMENTAL_KLINES_LIMIT:end].reset_index(drop=True)
+        result = am.update_macd_state(window, state)
+        assert result is not None, end
+        pattern, state = result
+        yield end, window, pattern
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_warm_pattern_matches_full_recompute(seed):
+    full = make_candles(400, seed)
+    steps = np.random.default_rng(seed).integers(1, 4, 100)
+    crosses = 0
+    for end, window, pattern in warm_runs(full, steps):
+        close = full['close'].to_numpy(np.float64, copy=True)[:end]
+        ref_idx, ref_dir, ref_max, ref_dist, ref_hist = am._macd_pattern_kernel(close, am.MACD_FAST, am.MACD_SLOW, am.MACD_SIGNAL)
+        zero_cross_idx, direction, max_hist, distance, hist = pattern
+        
+        assert distance == pytest.approx(ref_dist, abs=1e-9)
+        assert hist == pytest.approx(ref_hist, abs=1e-9)
+        
+        # Cross fora do alcance da partida a frio não conta como recente em nenhum dos caminhos
+        if ref_idx < 0 or end - 1 - ref_idx > am.MAX_ZERO_CROSS_AGE:
+            assert zero_cross_idx == -1, end
+            continue
+        crosses += 1
+        assert zero_cross_idx >= 0, end
+        assert direction == ref_dir
+        assert window['open_time'].iloc[zero_cross_idx] == full['open_time'].iloc[ref_idx]
+        assert max_hist == pytest.approx(ref_max, abs=1e-9)
+    assert crosses > 0
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_warm_detection_matches_full_recompute(seed):
+    full = make_candles(400, seed)
+    for end, window, pattern in warm_runs(full, [1] * 150):
+        warm = am.detect_macd_pattern('TEST', window, pattern)
+        cold = am.detect_macd_pattern('TEST', full.iloc[:end].reset_index(drop=True))
+        assert warm[0] == cold[0] and warm[1] == cold[1] and warm[9] == cold[9], end
+        assert warm[2:7] == pytest.approx(cold[2:7], abs=1e-9)
+
+
+def test_gap_falls_back_to_cold_start():
+    full = make_candles(300, 0)
+    state = am.seed_macd_state(full.iloc[:am.KLINES_LIMIT])
+    window = full.iloc[200:200 + am.INCREMENTAL_KLINES_LIMIT].reset_index(drop=True)
+    assert am.update_macd_state(window, state) is None